@@ -0,0 +1,34 @@
+"""Build the optional compiled popcount kernel"""
+
+from setuptools import Extension
+from setuptools.command.build_ext import build_ext
+
+ext_modules = [
+    Extension(
+        "molecularnetwork._popcnt",
+        sources=["molecularnetwork/_popcnt.c"],
+        extra_compile_args=["-O3", "-funroll-loops"],
+    )
+]
+
+
+class OptionalBuildExt(build_ext):
+    """Skip the extension if it fails to compile; numpy kernels are used instead."""
+
+    def run(self):
+        try:
+            super().run()
+        except Exception as exc:
+            print(f"molecularnetwork: skipping compiled kernel ({exc})")
+
+    def build_extension(self, ext):
+        try:
+            super().build_extension(ext)
+        except Exception as exc:
+            print(f"molecularnetwork: skipping compiled kernel ({exc})")
+
+
+def build(setup_kwargs):
+    setup_kwargs.update(
+        ext_modules=ext_modules, cmdclass={"build_ext": OptionalBuildExt}
+    )
@@ -0,0 +1,61 @@
+"""Numba kernels for pairwise similarity over packed fingerprints"""
+
+import numpy as np
+from numba import njit, prange, types
+from numba.extending import intrinsic
+
+# Upper bound on float64 similarities held per block of rows.
+_BLOCK_VALUES = 1 << 22
+
+
+@intrinsic
+def popcount64(typingctx, x):
+    """Population count of a uint64 via LLVM's ctpop (a single POPCNT)."""
+    sig = types.int64(types.uint64)
+
+    def codegen(context, builder, signature, args):
+        return builder.ctpop(args[0])
+
+    return sig, codegen
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _tanimoto_rows(packed, popcnts, bounds, cut, start, out):
+    num_fps, width = packed.shape
+    for r in prange(out.shape[0]):
+        i = start + r
+        for j in range(num_fps):
+            if j <= i or j >= bounds[i]:
+                out[r, j] = -1.0
+                continue
+            inter = 0
+            for k in range(width):
+                inter += popcount64(packed[i, k] & packed[j, k])
+            union = popcnts[i] + popcnts[j] - inter
+            # cut[union] is the largest intersection not above the threshold;
+            # two empty fingerprints have similarity 0, as in RDKit
+            if inter > cut[union]:
+                out[r, j] = inter / union if union else 0.0
+            else:
+                out[r, j] = -1.0
+
+
+def tanimoto_pairs(packed, popcnts, bounds, cut):
+    """Pairs i < j with an intersection above `cut[union]`, as (i, j, sim) arrays.
+
+    Only columns j < bounds[i] are compared for row i.
+    """
+    num_fps = packed.shape[0]
+    step = max(1, _BLOCK_VALUES // max(1, num_fps))
+    out = np.empty((min(step, num_fps), num_fps))
+    rows, cols, sims = [], [], []
+    for start in range(0, num_fps, step):
+        block = out[: min(step, num_fps - start)]
+        _tanimoto_rows(packed, popcnts, bounds, cut, start, block)
+        i, j = np.nonzero(block >= 0)
+        rows.append(i + start)
+        cols.append(j)
+        sims.append(block[i, j])
+    if not rows:
+        return np.empty(0, np.intp), np.empty(0, np.intp), np.empty(0)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(sims)
@@ -1,36 +1,128 @@
 """Molecular Featurization Pipeline"""
 
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
 from rdkit import Chem
 from rdkit.Chem import rdFingerprintGenerator
 from rdkit.Chem.rdMolDescriptors import GetMACCSKeysFingerprint
-from .utils import InvalidSMILESError
+from .utils import InvalidSMILESError, canonical_mol
+
+
+def _supplier_safe(smi):
+    # SMILES suppliers skip blank and "#" lines, which would shift record ids,
+    # and keep only the first whitespace-separated token, dropping CXSMILES
+    # extensions; such entries are parsed with MolFromSmiles instead
+    return smi[:1] not in ("", "#") and not any(c.isspace() for c in smi)
 
 
 class FingerprintCalculator:
-    def __init__(self, descriptor="morgan2"):
+    def __init__(self, descriptor="morgan2", cache_size=100_000):
         self.descriptor = descriptor
-        self.descriptors = {
+        self.cache_size = cache_size
+        self._generators = {
             "morgan2": rdFingerprintGenerator.GetMorganGenerator(
                 radius=2, includeChirality=False
-            ).GetFingerprint,
+            ),
             "morgan2_chiral": rdFingerprintGenerator.GetMorganGenerator(
                 radius=2, includeChirality=True
-            ).GetFingerprint,
+            ),
             "morgan3": rdFingerprintGenerator.GetMorganGenerator(
                 radius=3, includeChirality=False
-            ).GetFingerprint,
+            ),
             "morgan3_chiral": rdFingerprintGenerator.GetMorganGenerator(
                 radius=3, includeChirality=True
-            ).GetFingerprint,
-            "atom_pair": rdFingerprintGenerator.GetAtomPairGenerator().GetFingerprint,
-            "topological_torsion": rdFingerprintGenerator.GetTopologicalTorsionGenerator().GetFingerprint,
-            "rdkit": rdFingerprintGenerator.GetRDKitFPGenerator().GetFingerprint,
-            "maccs": GetMACCSKeysFingerprint
+            ),
+            "atom_pair": rdFingerprintGenerator.GetAtomPairGenerator(),
+            "topological_torsion": rdFingerprintGenerator.GetTopologicalTorsionGenerator(),
+            # path-based; roughly 10-30x slower to generate than morgan2 (ECFP4)
+            "rdkit": rdFingerprintGenerator.GetRDKitFPGenerator(),
+        }
+        self.descriptors = {
+            name: generator.GetFingerprint
+            for name, generator in self._generators.items()
         }
+        self.descriptors["maccs"] = GetMACCSKeysFingerprint
+        # canonical SMILES -> fingerprint, least recently used first
+        self._cache = OrderedDict()
+
+    def _cache_get(self, key):
+        fp = self._cache.get(key)
+        if fp is not None:
+            self._cache.move_to_end(key)
+        return fp
+
+    def _cache_put(self, key, fp):
+        self._cache[key] = fp
+        if self.cache_size is not None and len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
 
     def calculate_fingerprint(self, smi):
-        mol = Chem.MolFromSmiles(smi)
-        if mol and self.descriptor in self.descriptors:
-            fn = self.descriptors[self.descriptor]
-            return fn(mol)
-        raise InvalidSMILESError
+        if self.descriptor not in self.descriptors:
+            raise InvalidSMILESError
+        mol, key = canonical_mol(smi)
+        fp = self._cache_get(key)
+        if fp is None:
+            fp = self.descriptors[self.descriptor](mol)
+            self._cache_put(key, fp)
+        return fp
+
+    def calculate_batch(self, smiles_list, num_threads=1):
+        if self.descriptor not in self.descriptors:
+            raise InvalidSMILESError
+        unique = list(dict.fromkeys(smiles_list))
+        mols = self._parse_smiles(unique, num_threads)
+        keys = [Chem.MolToSmiles(mol) for mol in mols]
+        fps = {key: self._cache_get(key) for key in keys}
+        # only molecules not already cached are fingerprinted, once per key
+        missing = {key: mol for key, mol in zip(keys, mols) if fps[key] is None}
+        generator = self._generators.get(self.descriptor)
+        if generator is not None and hasattr(generator, "GetFingerprints"):
+            batch = generator.GetFingerprints(list(missing.values()), numThreads=num_threads)
+        else:
+            batch = map(self.descriptors[self.descriptor], missing.values())
+        for key, fp in zip(missing, batch):
+            fps[key] = fp
+            self._cache_put(key, fp)
+        by_smiles = dict(zip(unique, keys))
+        return [fps[by_smiles[smi]] for smi in smiles_list]
+
+    @staticmethod
+    def _parse_smiles(smiles_list, num_threads):
+        mols = [None] * len(smiles_list)
+        threaded = [i for i, smi in enumerate(smiles_list) if _supplier_safe(smi)]
+        if num_threads != 1 and threaded:
+            with tempfile.NamedTemporaryFile("w", suffix=".smi", delete=False) as f:
+                f.write("\n".join(smiles_list[i] for i in threaded))
+            try:
+                supplier = Chem.MultithreadedSmilesMolSupplier(
+                    f.name,
+                    titleLine=False,
+                    nameColumn=-1,
+                    numWriterThreads=max(1, num_threads),
+                )
+                # molecules arrive out of order; record ids are 1-based line numbers
+                for mol in supplier:
+                    if mol is not None:
+                        mols[threaded[supplier.GetLastRecordId() - 1]] = mol
+                del supplier
+            finally:
+                os.remove(f.name)
+        for i, mol in enumerate(mols):
+            if mol is None:
+                mol = Chem.MolFromSmiles(smiles_list[i])
+                if mol is None:
+                    raise InvalidSMILESError
+                mols[i] = mol
+        return mols
+
+    def calculate_fingerprint_packed(self, smi):
+        return self.pack_fingerprint(self.calculate_fingerprint(smi))
+
+    @staticmethod
+    def pack_fingerprint(fp):
+        bits = np.frombuffer(fp.ToBitString().encode(), "u1") - ord("0")
+        packed = np.packbits(bits)
+        return np.pad(packed, (0, -packed.size % 8)).view(np.uint64)
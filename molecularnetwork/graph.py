@@ -1,10 +1,24 @@
 """Generate Molecular Network"""
 
+import zipfile
+
 import networkx
 import numpy as np
-from joblib import dump, load
+from joblib import dump, effective_n_jobs, load
+from scipy.sparse import coo_matrix
 from .featurizer import FingerprintCalculator
-from .similarity import SimilarityCalculator
+from .similarity import SimilarityCalculator, popcount, tanimoto_edges
+
+# Below this many SMILES, thread start-up costs more than it saves.
+_PARALLEL_MIN_SMILES = 500
+# Node attributes set by `create_graph`; `save_graph` stores these as arrays.
+_NODE_ATTRIBUTES = {"smiles", "categorical_label", "fp"}
+
+
+def _stack_bits(rows):
+    if not rows:
+        return np.empty((0, 0), dtype=np.int64)
+    return np.array(rows, dtype=np.int64)
 
 
 class MolecularNetwork:
@@ -12,53 +26,82 @@ class MolecularNetwork:
                  descriptor="morgan2", 
                  sim_metric="tanimoto", 
                  sim_threshold=0.7,
-                 node_descriptor="morgan2"):
+                 node_descriptor="morgan2",
+                 n_jobs=-1):
         self.sim_threshold = sim_threshold
+        self.n_jobs = n_jobs
         self.fingerprint_calculator = FingerprintCalculator(descriptor)
         self.similarity_calculator = SimilarityCalculator(sim_metric)
         self.graph = networkx.Graph()
+        # packed tanimoto fingerprints, and the graph they were built for
+        self._fp_matrix = self._fp_popcnt = self._fp_graph = None
         self.node_fp_calculator = FingerprintCalculator(node_descriptor)
 
     def _create_graph(self, smiles_list, classes):
         if classes is None:
             classes = np.full(len(smiles_list), 0)
-        fps = self._calculate_fingerprints(self.fingerprint_calculator, smiles_list)
+        if self.similarity_calculator.sim_metric == "tanimoto":
+            fp_matrix, fp_popcnt = self._build_fp_soa(self.fingerprint_calculator, smiles_list)
+            edges = tanimoto_edges(fp_matrix, self.sim_threshold, fp_popcnt)
+        else:
+            fps = self._calculate_fingerprints(self.fingerprint_calculator, smiles_list)
+            edges = self._bulk_edges(fps)
+            fp_matrix = fp_popcnt = None
+        self._add_edges(len(smiles_list), *edges)
+        self._set_fp_soa(fp_matrix, fp_popcnt)
         model_fps = self._calculate_fingerprints(self.node_fp_calculator, smiles_list)
         self._add_nodes(smiles_list, model_fps, classes)
-        self._add_edges(fps)
 
     def _calculate_fingerprints(self, fp_calculator, smiles_list):
-        return [
-            fp_calculator.calculate_fingerprint(smi)
-            for smi in smiles_list
-        ]
+        n_jobs = effective_n_jobs(self.n_jobs)
+        if n_jobs == 1 or len(smiles_list) < _PARALLEL_MIN_SMILES:
+            return [fp_calculator.calculate_fingerprint(smi) for smi in smiles_list]
+        return fp_calculator.calculate_batch(smiles_list, num_threads=n_jobs)
+
+    def _build_fp_soa(self, fp_calculator, smiles_list):
+        fps = self._calculate_fingerprints(fp_calculator, smiles_list)
+        width = -(-fps[0].GetNumBits() // 64) if fps else 0
+        fp_matrix = np.empty((len(fps), width), dtype=np.uint64)
+        for i, fp in enumerate(fps):
+            fp_matrix[i] = fp_calculator.pack_fingerprint(fp)
+        return fp_matrix, popcount(fp_matrix)
 
     def _add_nodes(self, smiles_list, model_fps, classes):
-        num_nodes = len(smiles_list)
-        nodes = range(num_nodes)
-        weighted_nodes = [
-            (
-                node,
-                {
-                    "smiles": smiles_list[node],
-                    "categorical_label": str(value),
-                    "fp": np.array(model_fps[node].ToList())
-                },
-            )
-            for node, value in zip(nodes, classes)
-        ]
-        self.graph.add_nodes_from(weighted_nodes)
+        self.smiles_arr = np.asarray(smiles_list, dtype=object)
+        self.labels_arr = np.array([str(value) for value in classes], dtype=str)
+        self.node_fp_bits = _stack_bits([fp.ToList() for fp in model_fps])
+        self._set_node_attributes()
 
-    def _add_edges(self, fps):
+    def _set_node_attributes(self):
+        self.graph.add_nodes_from(range(len(self.smiles_arr)))
+        for name, values in (
+            ("smiles", self.smiles_arr.tolist()),
+            ("categorical_label", self.labels_arr.tolist()),
+            ("fp", list(self.node_fp_bits)),
+        ):
+            networkx.set_node_attributes(self.graph, dict(enumerate(values)), name)
+
+    def _bulk_edges(self, fps):
         num_nodes = len(fps)
-        for i in range(num_nodes):
-            for j in range(i + 1, num_nodes):
-                sim_val = self._calculate_similarity(fps[i], fps[j])
-                if sim_val > self.sim_threshold:
-                    self.graph.add_edge(i, j, similarity=sim_val)
+        rows, cols, sims = [], [], []
+        for i in range(num_nodes - 1):
+            row_sims = np.asarray(
+                self.similarity_calculator.calculate_bulk_similarity(fps[i], fps[i + 1:])
+            )
+            hits = np.flatnonzero(row_sims > self.sim_threshold)
+            rows.append(np.full(hits.size, i))
+            cols.append(hits + i + 1)
+            sims.append(row_sims[hits])
+        if not rows:
+            return np.empty(0, np.intp), np.empty(0, np.intp), np.empty(0)
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(sims)
 
-    def _calculate_similarity(self, fp1, fp2):
-        return self.similarity_calculator.calculate_similarity(fp1, fp2)
+    def _add_edges(self, num_nodes, rows, cols, sims):
+        # assembled once as CSR; networkx then only walks the nnz entries
+        adjacency = coo_matrix((sims, (rows, cols)), shape=(num_nodes, num_nodes))
+        self.graph = networkx.from_scipy_sparse_array(
+            adjacency.tocsr(), edge_attribute="similarity"
+        )
 
     def create_graph(self, smiles_list, classes=None):
         self._create_graph(smiles_list, classes)
@@ -68,8 +111,87 @@ class MolecularNetwork:
         return self.graph
 
     def save_graph(self, graph_filename: str):
-        dump(self.graph, graph_filename)
+        arrays = self._graph_arrays()
+        if arrays is None:
+            # the graph holds more than the arrays below can represent
+            dump(self.graph, graph_filename)
+            return
+        # write through a file object so numpy does not append ".npz"
+        with open(graph_filename, "wb") as f:
+            np.savez_compressed(f, **arrays)
+
+    def _graph_arrays(self):
+        """`self.graph` as the arrays `read_graph` rebuilds it from, or None."""
+        graph = self.graph
+        num_nodes = graph.number_of_nodes()
+        if type(graph) is not networkx.Graph or graph.graph:
+            return None
+        if set(graph.nodes) != set(range(num_nodes)):
+            return None
+        nodes = [graph.nodes[n] for n in range(num_nodes)]
+        if any(node.keys() != _NODE_ATTRIBUTES for node in nodes):
+            return None
+        smiles = [node["smiles"] for node in nodes]
+        labels = [node["categorical_label"] for node in nodes]
+        if not all(isinstance(value, str) for value in smiles + labels):
+            return None
+        fp_rows = [node["fp"] for node in nodes]
+        if not all(isinstance(fp, np.ndarray) and fp.ndim == 1 for fp in fp_rows):
+            return None
+        if len({fp.size for fp in fp_rows}) > 1:
+            return None
+        node_fp = _stack_bits(fp_rows)
+        if not np.isin(node_fp, (0, 1)).all():
+            return None
+        if any(data.keys() != {"similarity"} for _, _, data in graph.edges(data=True)):
+            return None
+        edges = list(graph.edges(data="similarity"))
+        ei, ej, sims = zip(*edges) if edges else ((), (), ())
+        # the packed fingerprints only describe the graph they were built for,
+        # and only while none of its nodes were added or removed
+        fp_matrix, fp_popcnt = self._fp_matrix, self._fp_popcnt
+        if self._fp_graph is not graph or fp_matrix.shape[0] != num_nodes:
+            fp_matrix = np.empty((0, 0), dtype=np.uint64)
+            fp_popcnt = np.empty(0, dtype=np.int64)
+        return {
+            "fp_matrix": fp_matrix,
+            "popcnt": fp_popcnt,
+            "smiles": np.array(smiles, dtype=str),
+            "labels": np.array(labels, dtype=str),
+            "node_fp": np.packbits(node_fp.astype(bool), axis=1),
+            "node_fp_nbits": node_fp.shape[1],
+            "ei": np.asarray(ei, dtype=np.int32),
+            "ej": np.asarray(ej, dtype=np.int32),
+            "sim": np.asarray(sims, dtype=np.float64),
+        }
 
     def read_graph(self, graph_filename: str):
-        self.graph = load(graph_filename)
+        if not zipfile.is_zipfile(graph_filename):
+            # saved with joblib, by earlier versions or for graphs with extra data
+            self.graph = load(graph_filename)
+            self._set_fp_soa(None, None)
+            arrays = self._graph_arrays()
+            if arrays is not None:
+                self._set_arrays(arrays)
+            return self.graph
+        with np.load(graph_filename) as data:
+            self._set_arrays(data)
+            self._add_edges(len(self.smiles_arr), data["ei"], data["ej"], data["sim"])
+            self._set_fp_soa(data["fp_matrix"], data["popcnt"])
+        self._set_node_attributes()
         return self.graph
+
+    def _set_fp_soa(self, fp_matrix, fp_popcnt):
+        # ties the packed fingerprints to the current self.graph
+        if fp_matrix is None or fp_matrix.shape[0] == 0:
+            self._fp_matrix = self._fp_popcnt = self._fp_graph = None
+        else:
+            self._fp_matrix, self._fp_popcnt = fp_matrix, fp_popcnt
+            self._fp_graph = self.graph
+
+    def _set_arrays(self, arrays):
+        self.smiles_arr = arrays["smiles"].astype(object)
+        self.labels_arr = arrays["labels"]
+        nbits = int(arrays["node_fp_nbits"])
+        node_fp = np.unpackbits(arrays["node_fp"], axis=1, count=nbits)
+        self.node_fp_bits = node_fp.astype(np.int64)
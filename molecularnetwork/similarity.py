@@ -1,7 +1,38 @@
 """ Similarity Functions """
 
+import numpy as np
 from rdkit.Chem import DataStructs
 
+try:
+    from . import _popcnt
+except ImportError:  # compiled kernel is optional
+    _popcnt = None
+
+try:
+    from . import _kernels
+except ImportError:  # numba is optional
+    _kernels = None
+
+# Upper bound on uint64 words held by the (rows, N, W) intermediate of a chunk.
+_CHUNK_WORDS = 1 << 22
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+# Tversky weights on the features unique to the first and second fingerprint.
+_TVERSKY_A = 0.2
+_TVERSKY_B = 0.8
+
+# Metrics with f(a, b) == f(b, a); "asymmetric" is c / min(|a|, |b|), so it is too.
+SYMMETRIC_METRICS = {
+    "asymmetric",
+    "braunblanquet",
+    "cosine",
+    "dice",
+    "kulczynski",
+    "onbit",
+    "rogotgoldberg",
+    "sokal",
+    "tanimoto",
+}
+
 
 class SimilarityCalculator:
     def __init__(self, sim_metric="tanimoto"):
@@ -17,12 +48,129 @@ class SimilarityCalculator:
             "sokal": DataStructs.SokalSimilarity,
             "tanimoto": DataStructs.TanimotoSimilarity,
             "tversky": lambda m1, m2: DataStructs.TverskySimilarity(
-                m1, m2, a=0.2, b=0.8
+                m1, m2, a=_TVERSKY_A, b=_TVERSKY_B
+            ),
+        }
+        self.bulk_metrics = {
+            "asymmetric": DataStructs.BulkAsymmetricSimilarity,
+            "braunblanquet": DataStructs.BulkBraunBlanquetSimilarity,
+            "cosine": DataStructs.BulkCosineSimilarity,
+            "dice": DataStructs.BulkDiceSimilarity,
+            "kulczynski": DataStructs.BulkKulczynskiSimilarity,
+            "onbit": DataStructs.BulkOnBitSimilarity,
+            "rogotgoldberg": DataStructs.BulkRogotGoldbergSimilarity,
+            "sokal": DataStructs.BulkSokalSimilarity,
+            "tanimoto": DataStructs.BulkTanimotoSimilarity,
+            "tversky": lambda m, ms: DataStructs.BulkTverskySimilarity(
+                m, ms, _TVERSKY_A, _TVERSKY_B
             ),
         }
+        # f(b, a) for each b in ms, for the metrics not in SYMMETRIC_METRICS
+        self.swapped_bulk_metrics = {
+            "tversky": lambda m, ms: DataStructs.BulkTverskySimilarity(
+                m, ms, _TVERSKY_B, _TVERSKY_A
+            ),
+        }
+        self._sym = sim_metric in SYMMETRIC_METRICS
+        self._fn = self.metrics[sim_metric]
+        self._bulk_fn = self.bulk_metrics[sim_metric]
+        self._swapped_bulk_fn = self.swapped_bulk_metrics.get(sim_metric)
 
     def calculate_similarity(self, fp1, fp2):
-        return max(
-            self.metrics[self.sim_metric](fp1, fp2),
-            self.metrics[self.sim_metric](fp2, fp1),
+        if self._sym:
+            return self._fn(fp1, fp2)
+        return max(self._fn(fp1, fp2), self._fn(fp2, fp1))
+
+    def calculate_bulk_similarity(self, fp, fps):
+        sims = self._bulk_fn(fp, fps)
+        if self._sym:
+            return sims
+        if self._swapped_bulk_fn is not None:
+            swapped = self._swapped_bulk_fn(fp, fps)
+        else:
+            swapped = [self._fn(other, fp) for other in fps]
+        return [max(s1, s2) for s1, s2 in zip(sims, swapped)]
+
+
+def popcount(words):
+    """Number of set bits in `words`, summed over the last axis."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def tanimoto_edges(packed, threshold, popcnt=None):
+    """All pairs i < j of `packed` rows with tanimoto similarity above `threshold`.
+
+    `popcnt` holds the precomputed bit count of each row, if available.
+    Returns the row indices, column indices and similarities as three arrays.
+    """
+    packed = np.ascontiguousarray(packed, dtype=np.uint64)
+    pa = popcount(packed) if popcnt is None else np.ascontiguousarray(popcnt, np.int64)
+    # Rows sorted by bit count let each row stop at the first column that
+    # popcount alone rules out: tanimoto(a, b) <= |a| / |b| when |a| <= |b|.
+    # The threshold test itself is a lookup on the union, with no division.
+    order = np.argsort(pa, kind="stable")
+    packed, pa = packed[order], pa[order]
+    cut = _tanimoto_cutoffs(threshold, packed.shape[1] * 64)
+    bounds = _tanimoto_bounds(pa, cut)
+    rows, cols, sims = _tanimoto_pairs_sorted(packed, pa, bounds, cut)
+    rows, cols = order[rows], order[cols]
+    rows, cols = np.minimum(rows, cols), np.maximum(rows, cols)
+    edge_order = np.lexsort((cols, rows))
+    return rows[edge_order], cols[edge_order], sims[edge_order]
+
+
+def _tanimoto_cutoffs(threshold, nbits):
+    """Largest intersection per union size, 0..nbits, whose tanimoto is not above `threshold`.
+
+    `inter / union > threshold` is then `inter > cut[union]`, which agrees with
+    the float comparison for every pair; union 0 stands for similarity 0.
+    """
+    threshold = float(threshold)
+    union = np.arange(1, nbits + 1)
+    cut = np.clip(np.floor(threshold * union), -1, union).astype(np.int64)
+    # floor(threshold * union) can land one off; settle it on the quotient itself
+    up = (cut < union) & ((cut + 1) / union <= threshold)
+    cut[up] += 1
+    down = (cut >= 0) & (cut / union > threshold)
+    cut[down] -= 1
+    return np.concatenate(([0 if threshold >= 0 else -1], cut)).astype(np.int64)
+
+
+def _tanimoto_bounds(pa, cut):
+    """Exclusive column bound per row of popcount-sorted fingerprints."""
+    # The best j can do against row i is inter = |a|, union = |b|, and cut is
+    # non-decreasing, so row i keeps j while |a| > cut[|b|].
+    return np.searchsorted(cut[pa], pa, side="left").astype(np.int64)
+
+
+def _tanimoto_pairs_sorted(packed, pa, bounds, cut):
+    if _popcnt is not None:
+        rows, cols, sims = _popcnt.tanimoto_matrix(packed, pa, bounds, cut)
+        return (
+            np.frombuffer(rows, np.int32),
+            np.frombuffer(cols, np.int32),
+            np.frombuffer(sims, np.float64),
         )
+    if _kernels is not None:
+        return _kernels.tanimoto_pairs(packed, pa, bounds, cut)
+    num_fps, width = packed.shape
+    step = max(1, _CHUNK_WORDS // max(1, num_fps * width))
+    rows, cols, sims = [], [], []
+    for start in range(0, num_fps, step):
+        stop = min(start + step, num_fps)
+        end = bounds[stop - 1]
+        if end <= start + 1:
+            continue
+        inter = popcount(packed[start:stop, None, :] & packed[None, start:end, :])
+        union = pa[start:stop, None] + pa[None, start:end] - inter
+        passed = inter > cut[union]
+        i, j = np.nonzero(np.triu(passed, k=1))
+        inter, union = inter[i, j], union[i, j]
+        rows.append(i + start)
+        cols.append(j + start)
+        sims.append(np.divide(inter, union, out=np.zeros(i.size), where=union > 0))
+    if not rows:
+        return np.empty(0, np.intp), np.empty(0, np.intp), np.empty(0)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(sims)
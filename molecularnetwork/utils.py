@@ -1,5 +1,7 @@
 """Utils for molecularnetwork"""
 
+from rdkit import Chem
+
 
 class InvalidSMILESError(Exception):
     """
@@ -9,3 +11,34 @@ class InvalidSMILESError(Exception):
 
         message (str): Explanation of the error.
     """
+
+
+def canonical_smiles(smi):
+    """
+    Canonical SMILES for `smi`, used as a toolkit-independent molecule key.
+
+    Equivalent SMILES (different atom order, aromatic vs kekule form) map to
+    the same string, unlike hashing the input text directly.
+
+    Raises:
+
+        InvalidSMILESError: If `smi` cannot be parsed.
+    """
+    return canonical_mol(smi)[1]
+
+
+def canonical_mol(smi):
+    """
+    Parsed molecule for `smi` together with its canonical SMILES.
+
+    Lets callers key on the canonical SMILES and still use the molecule,
+    without parsing `smi` a second time.
+
+    Raises:
+
+        InvalidSMILESError: If `smi` cannot be parsed.
+    """
+    mol = Chem.MolFromSmiles(smi)
+    if mol is None:
+        raise InvalidSMILESError
+    return mol, Chem.MolToSmiles(mol)
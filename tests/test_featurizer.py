@@ -0,0 +1,57 @@
+import pytest
+
+from molecularnetwork.featurizer import FingerprintCalculator
+from molecularnetwork.utils import InvalidSMILESError
+
+SMILES = [
+    "CCO",
+    "OCC",
+    " CCO",
+    "CCO ",
+    "c1ccccc1O",
+    "Oc1ccccc1",
+    "OC1=CC=CC=C1",
+    "CC(=O)Oc1ccccc1C(=O)O",
+    "CN1C=NC2=C1C(=O)N(C(=O)N2C)C",
+    "CCC |^1:1|",
+    "CCO",
+] * 60
+
+
+@pytest.mark.parametrize("descriptor", ["morgan2", "maccs"])
+@pytest.mark.parametrize("num_threads", [1, 4])
+def test_batch_matches_serial(descriptor, num_threads):
+    serial = [FingerprintCalculator(descriptor).calculate_fingerprint(smi) for smi in SMILES]
+    batch = FingerprintCalculator(descriptor).calculate_batch(SMILES, num_threads=num_threads)
+    assert batch == serial
+
+
+def test_cache_is_keyed_on_canonical_smiles():
+    calculator = FingerprintCalculator(cache_size=2)
+    fp = calculator.calculate_fingerprint("CCO")
+    assert calculator.calculate_fingerprint("OCC") is fp
+    assert calculator.calculate_fingerprint("C(O)C") is fp
+    assert calculator.calculate_fingerprint("Oc1ccccc1") is calculator.calculate_fingerprint(
+        "OC1=CC=CC=C1"
+    )
+    calculator.calculate_fingerprint("CCN")
+    assert len(calculator._cache) == 2
+
+
+def test_batch_shares_the_cache():
+    calculator = FingerprintCalculator(cache_size=2)
+    batch = calculator.calculate_batch(["CCO", "OCC", "c1ccccc1O", "OC1=CC=CC=C1"])
+    assert batch[0] is batch[1]
+    assert batch[2] is batch[3]
+    assert calculator.calculate_fingerprint("C(O)C") is batch[0]
+    assert len(calculator._cache) == 2
+
+
+def test_invalid_smiles():
+    calculator = FingerprintCalculator()
+    with pytest.raises(InvalidSMILESError):
+        calculator.calculate_fingerprint("C1CC")
+    with pytest.raises(InvalidSMILESError):
+        calculator.calculate_batch(["CCO", "C1CC"] * 300, num_threads=4)
+    with pytest.raises(InvalidSMILESError):
+        calculator.calculate_batch(["CCO", "CCO |$;;$,bad"] * 300, num_threads=4)
@@ -0,0 +1,95 @@
+import zipfile
+
+import numpy as np
+from joblib import dump
+
+from molecularnetwork import MolecularNetwork
+
+SMILES = [
+    "CCO",
+    "CCN",
+    "CCCO",
+    "CCCN",
+    "c1ccccc1",
+    "c1ccccc1O",
+    "c1ccccc1N",
+    "Cc1ccccc1",
+    "CC(=O)Oc1ccccc1C(=O)O",
+    "CC(C)Cc1ccc(cc1)C(C)C(=O)O",
+]
+
+
+def _contents(graph):
+    nodes = [
+        (n, d["smiles"], d["categorical_label"], np.asarray(d["fp"]).tolist())
+        for n, d in sorted(graph.nodes(data=True))
+    ]
+    edges = sorted((min(u, v), max(u, v), d) for u, v, d in graph.edges(data=True))
+    return nodes, edges
+
+
+def _round_trip(network, path):
+    network.save_graph(str(path))
+    return MolecularNetwork().read_graph(str(path))
+
+
+def test_round_trip(tmp_path):
+    for metric in ("tanimoto", "dice"):
+        network = MolecularNetwork(sim_metric=metric, sim_threshold=0.2)
+        graph = network.create_graph(SMILES, [i % 3 for i in range(len(SMILES))])
+        assert graph.number_of_edges() > 0
+        restored = _round_trip(network, tmp_path / f"{metric}.npz")
+        assert zipfile.is_zipfile(tmp_path / f"{metric}.npz")
+        assert _contents(restored) == _contents(graph)
+
+
+def test_round_trip_without_graph(tmp_path):
+    restored = _round_trip(MolecularNetwork(), tmp_path / "empty.npz")
+    assert restored.number_of_nodes() == 0
+
+
+def test_round_trip_after_edits(tmp_path):
+    network = MolecularNetwork(sim_threshold=0.2)
+    graph = network.create_graph(SMILES)
+    graph.remove_edge(*next(iter(graph.edges)))
+    graph.nodes[1]["categorical_label"] = "edited"
+    assert _contents(_round_trip(network, tmp_path / "edited.npz")) == _contents(graph)
+
+    # beyond what the arrays can hold, so saved with joblib instead
+    graph.remove_node(3)
+    graph.nodes[2]["note"] = "extra"
+    restored = _round_trip(network, tmp_path / "extra.npz")
+    assert not zipfile.is_zipfile(tmp_path / "extra.npz")
+    assert _contents(restored) == _contents(graph)
+    assert restored.nodes[2]["note"] == "extra"
+
+
+def test_read_joblib_graph(tmp_path):
+    graph = MolecularNetwork(sim_threshold=0.2).create_graph(SMILES)
+    dump(graph, tmp_path / "graph.joblib")
+    network = MolecularNetwork()
+    assert _contents(network.read_graph(str(tmp_path / "graph.joblib"))) == _contents(graph)
+    assert _contents(_round_trip(network, tmp_path / "graph.npz")) == _contents(graph)
+
+
+def test_packed_fingerprints_follow_the_graph(tmp_path):
+    other = SMILES[::-1]
+    dump(MolecularNetwork().create_graph(other), tmp_path / "other.joblib")
+    network = MolecularNetwork(sim_threshold=0.2)
+    network.create_graph(SMILES)
+    network.save_graph(str(tmp_path / "own.npz"))
+    with np.load(tmp_path / "own.npz") as data:
+        own_matrix = data["fp_matrix"]
+    assert own_matrix.shape[0] == len(SMILES)
+
+    # a graph of the same size read from elsewhere must not inherit the matrix
+    network.read_graph(str(tmp_path / "other.joblib"))
+    network.save_graph(str(tmp_path / "other.npz"))
+    with np.load(tmp_path / "other.npz") as data:
+        assert data["fp_matrix"].size == 0
+        assert data["smiles"].tolist() == other
+
+    network.read_graph(str(tmp_path / "own.npz"))
+    network.save_graph(str(tmp_path / "again.npz"))
+    with np.load(tmp_path / "again.npz") as data:
+        assert np.array_equal(data["fp_matrix"], own_matrix)
@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+from rdkit.Chem import DataStructs
+
+from molecularnetwork import similarity
+from molecularnetwork.featurizer import FingerprintCalculator
+from molecularnetwork.similarity import SimilarityCalculator, tanimoto_edges
+
+SMILES = [
+    "C",
+    "O",
+    "CCO",
+    "OCC",
+    "CCN",
+    "CCCCO",
+    "c1ccccc1",
+    "c1ccccc1O",
+    "Cc1ccccc1",
+    "CC(=O)Oc1ccccc1C(=O)O",
+    "CN1C=NC2=C1C(=O)N(C(=O)N2C)C",
+    "CC(C)Cc1ccc(cc1)C(C)C(=O)O",
+]
+THRESHOLDS = [-0.5, 0.0, 0.3, 0.5, 0.7, 1.0]
+
+
+@pytest.fixture(params=["c", "numba", "numpy"])
+def backend(request, monkeypatch):
+    if request.param == "c":
+        if similarity._popcnt is None:
+            pytest.skip("compiled kernel not built")
+    else:
+        monkeypatch.setattr(similarity, "_popcnt", None)
+    if request.param == "numba" and similarity._kernels is None:
+        pytest.skip("numba not installed")
+    if request.param == "numpy":
+        monkeypatch.setattr(similarity, "_kernels", None)
+    return request.param
+
+
+def _pack(fps):
+    return np.vstack([FingerprintCalculator.pack_fingerprint(fp) for fp in fps])
+
+
+def _edges(packed, threshold):
+    rows, cols, sims = tanimoto_edges(packed, threshold)
+    return dict(zip(zip(rows.tolist(), cols.tolist()), sims.tolist()))
+
+
+def _rdkit_edges(fps, threshold):
+    edges = {}
+    for i, fp in enumerate(fps):
+        sims = DataStructs.BulkTanimotoSimilarity(fp, fps[i + 1:])
+        for j, sim in enumerate(sims, i + 1):
+            if sim > threshold:
+                edges[(i, j)] = sim
+    return edges
+
+
+def _bit_vector(nbits, on_bits):
+    fp = DataStructs.ExplicitBitVect(nbits)
+    fp.SetBitsFromList([int(bit) for bit in on_bits])
+    return fp
+
+
+@pytest.mark.parametrize("descriptor", ["morgan2", "maccs", "atom_pair"])
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+def test_matches_rdkit(backend, descriptor, threshold):
+    calculator = FingerprintCalculator(descriptor)
+    fps = [calculator.calculate_fingerprint(smi) for smi in SMILES]
+    assert _edges(_pack(fps), threshold) == pytest.approx(_rdkit_edges(fps, threshold))
+
+
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+def test_empty_fingerprints(backend, threshold):
+    # RDKit scores two empty fingerprints 0.0, not 1.0
+    fps = [_bit_vector(64, []), _bit_vector(64, []), _bit_vector(64, [1, 2])]
+    assert _edges(_pack(fps), threshold) == _rdkit_edges(fps, threshold)
+
+
+@pytest.mark.parametrize("threshold", [0.7, 0.69999999, 0.7000001, 0.1 * 3, 1 / 3])
+def test_exact_ties(backend, threshold):
+    # intersections over unions that sit right on or next to the threshold
+    fps = [_bit_vector(128, range(10))]
+    fps += [_bit_vector(128, range(k)) for k in range(1, 10)]
+    fps += [_bit_vector(128, list(range(7)) + list(range(100, 103)))]
+    assert _edges(_pack(fps), threshold) == _rdkit_edges(fps, threshold)
+
+
+@pytest.mark.parametrize("nbits", [64, 192, 320, 1000])
+def test_widths(backend, nbits):
+    # 3 and 5 words are not a multiple of the 4-word AVX2 step
+    rng = np.random.default_rng(nbits)
+    fps = [
+        _bit_vector(nbits, np.flatnonzero(rng.random(nbits) < density))
+        for density in rng.uniform(0.05, 0.5, 40)
+    ]
+    assert _edges(_pack(fps), 0.3) == pytest.approx(_rdkit_edges(fps, 0.3))
+
+
+@pytest.mark.parametrize("num_fps", [0, 1])
+def test_few_fingerprints(backend, num_fps):
+    packed = np.zeros((num_fps, 4), dtype=np.uint64)
+    rows, cols, sims = tanimoto_edges(packed, -1.0)
+    assert rows.size == cols.size == sims.size == 0
+
+
+def test_cutoffs_match_float_division():
+    for threshold in np.linspace(-0.2, 1.2, 71).tolist() + [0.1 * 3, 2 / 3]:
+        cut = similarity._tanimoto_cutoffs(threshold, 100)
+        for union in range(1, 101):
+            passing = [inter for inter in range(union + 1) if inter / union > threshold]
+            assert cut[union] == (passing[0] if passing else union + 1) - 1
+
+
+def _metric_fingerprints():
+    calculator = FingerprintCalculator("morgan2")
+    return [calculator.calculate_fingerprint(smi) for smi in SMILES]
+
+
+@pytest.mark.parametrize("metric", sorted(SimilarityCalculator().metrics))
+def test_similarity_is_max_of_both_directions(metric):
+    calculator = SimilarityCalculator(metric)
+    f = calculator.metrics[metric]
+    fps = _metric_fingerprints()
+    for fp in fps:
+        for other in fps:
+            expected = max(f(fp, other), f(other, fp))
+            assert calculator.calculate_similarity(fp, other) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("metric", sorted(SimilarityCalculator().metrics))
+def test_bulk_similarity_is_max_of_both_directions(metric):
+    # tversky is the one metric that goes through swapped_bulk_metrics
+    calculator = SimilarityCalculator(metric)
+    f = calculator.metrics[metric]
+    fps = _metric_fingerprints()
+    for fp in fps:
+        expected = [max(f(fp, other), f(other, fp)) for other in fps]
+        assert list(calculator.calculate_bulk_similarity(fp, fps)) == pytest.approx(expected)